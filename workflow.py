@@ -2,11 +2,23 @@ import os
 import json
 import io
 import logging
+import logging.handlers
+import hashlib
+import functools
+import random
+import re
+import sqlite3
+import unicodedata
+import zipfile
+from xml.etree import ElementTree
 from datetime import datetime
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+from dataclasses import dataclass, asdict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import time
-import pickle
 import uuid
 import threading
 
@@ -14,26 +26,48 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import PyPDF2
-from docx import Document
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+import fitz  # PyMuPDF
 import openpyxl
+import orjson
 from langchain_groq import ChatGroq
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from flask import Flask, request
+from waitress import serve
 
 # LOGGING
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# File writes are buffered and flushed in batches, on any ERROR record, after each
+# organize pass (flush_logs), and at exit
+_log_file_handler = logging.FileHandler('drive_organizer.log')
+_log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_log_buffer = logging.handlers.MemoryHandler(
+    capacity=256,
+    flushLevel=logging.ERROR,
+    target=_log_file_handler
+)
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('drive_organizer.log'),
-        logging.StreamHandler()
-    ]
+    format=LOG_FORMAT,
+    handlers=[_log_buffer, logging.StreamHandler()]
 )
 logger = logging.getLogger(__name__)
 
+
+def flush_logs():
+    """Write buffered records to the log file so it never lags a finished pass"""
+    _log_buffer.flush()
+
+
 # CONFIGURATION
 SCOPES = ['https://www.googleapis.com/auth/drive']
+TOKEN_PATH = "token.json"
+FOLDER_CACHE_PATH = "folder_cache.json"  # Category folder ids from previous runs
+STATE_DB_PATH = "organizer_state.db"  # Ids of files already organized
 
 CATEGORIES = [
     "HR",
@@ -45,10 +79,67 @@ CATEGORIES = [
     "Miscellaneous"
 ]
 
+LLM_MODEL = "llama-3.3-70b-versatile"
+METADATA_LLM_MODEL = "llama-3.1-8b-instant"  # Name/MIME-only pre-classification
 CONFIDENCE_THRESHOLD = 0.7
+METADATA_CONFIDENCE_THRESHOLD = 0.85  # Higher bar since no content was seen
+CLASSIFY_BATCH_SIZE = 10  # Files per content-classification LLM call
+METADATA_BATCH_SIZE = 25  # Files per metadata pre-pass call; names alone are short
 MAX_CONTENT_LENGTH = 3000
+BATCH_PREVIEW_LENGTH = MAX_CONTENT_LENGTH // CLASSIFY_BATCH_SIZE  # Content chars per file in batch prompts
+
+# CACHING
+CACHE_DIR = os.path.expanduser("~/.cache")
+CLASSIFICATION_CACHE_PATH = os.path.join(CACHE_DIR, "drive_organizer.db")
+CLASSIFICATION_MEMORY_CACHE_SIZE = 1024  # Hot entries kept in-process in front of SQLite
+CONTENT_CACHE_PATH = os.path.join(CACHE_DIR, "drive_organizer_content.db")
+CONTENT_CACHE_MAX_ENTRIES = 20000  # Extracted previews are <= MAX_CONTENT_LENGTH chars each
+EXTRACT_MEMORY_CACHE_SIZE = 512  # Extracted texts memoized by content hash within a process
+
+# PDF EXTRACTION
+PDF_MAX_PAGES = 5
+PDF_PROCESS_MIN_BYTES = 1024 * 1024  # Below this, handing off to a process costs more than parsing
+PDF_PROCESS_WORKERS = min(os.cpu_count() or 1, 4)
+
+# WORDPROCESSINGML (DOCX) XML NAMESPACE
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Parser for each MIME type by exact match; substrings are ambiguous (the xlsx and pptx
+# types both contain "document"). Google Docs/Slides are downloaded as text/plain exports,
+# other text/* types are read as text, and anything else is classified by filename.
+EXTRACTABLE_MIME_TYPES = {
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/vnd.google-apps.document": "text",
+    "application/vnd.google-apps.presentation": "text",
+}
+
+# CONCURRENCY
+MAX_WORKERS = 8
+DRIVE_BATCH_SIZE = 100  # Max requests per Drive batch HTTP call
+HTTP_TIMEOUT = 30  # Seconds per Drive HTTP request
+WEBHOOK_SERVER_THREADS = 8
+
+# RATE LIMITS AND RETRIES
+# Steady-state caps shared by all workers; backoff only kicks in on real throttling
+DRIVE_CALLS_PER_SECOND = 20
+GROQ_CALLS_PER_SECOND = 5
+RETRY_ATTEMPTS = 5
+RETRY_INITIAL_WAIT = 0.5  # Seconds, doubled on each attempt
+RETRY_MAX_WAIT = 8
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+RATE_LIMIT_REASONS = frozenset({"rateLimitExceeded", "userRateLimitExceeded"})  # Drive quota errors sent as 403
+
+# DRIVE REQUESTS
+FILE_FIELDS = "id, name, mimeType, size, createdTime, modifiedTime, parents"  # Everything FileInfo needs
+CHANGES_PAGE_SIZE = 1000  # Maximum allowed by changes.list
 
 # MIME TYPES TO SKIP
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+SKIP_MIME_TYPES = frozenset({
+    FOLDER_MIME_TYPE
+})
 SKIP_MIME_PREFIXES = (
     "image/",
     "video/",
@@ -59,19 +150,30 @@ SKIP_MIME_PREFIXES = (
 app = Flask(__name__)
 organizer_instance = None
 
+# Webhook scans run on a small pool; only one scan runs at a time and
+# notifications that arrive meanwhile are folded into a single rescan
+WEBHOOK_POOL = ThreadPoolExecutor(max_workers=2)
+_scan_requested = threading.Event()
+_scan_lock = threading.Lock()
+
+# Credentials shared by every GoogleDriveClient in this process, keyed by client secrets path
+_CREDENTIALS_CACHE: Dict[str, Credentials] = {}
+
 
 # DATA MODELS
-@dataclass
+# Slotted and frozen: no per-instance __dict__ on large listings, and instances are hashable
+@dataclass(slots=True, frozen=True)
 class FileInfo:
     id: str
     name: str
     mime_type: str
     size: int
     created_time: str
-    parents: List[str]
+    modified_time: str
+    parents: Tuple[str, ...]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Classification:
     category: str
     confidence: float
@@ -79,19 +181,154 @@ class Classification:
     subcategory: Optional[str] = None
 
 
+# RATE LIMITING AND RETRIES
+class RateLimiter:
+    """Thread-safe token bucket shared by all workers"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            # Reserve the tokens now and sleep off any deficit outside the lock
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+def _is_retryable(error: HttpError) -> bool:
+    """True for 429/5xx, and for 403s that Drive uses to signal quota exhaustion"""
+    status = error.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status != 403:
+        return False
+    details = getattr(error, "error_details", None) or []
+    reasons = {d.get("reason") for d in details if isinstance(d, dict)}
+    return bool(reasons & RATE_LIMIT_REASONS) or any(
+        reason in str(error) for reason in RATE_LIMIT_REASONS
+    )
+
+
+def _backoff_wait(attempt: int) -> float:
+    """Exponential backoff with jitter for the given 0-based retry attempt"""
+    wait = min(RETRY_MAX_WAIT, RETRY_INITIAL_WAIT * 2 ** attempt)
+    return wait + random.uniform(0, RETRY_INITIAL_WAIT)
+
+
+def retry_with_backoff(func):
+    """Retry a Drive call on rate-limit/server errors with exponential backoff and jitter"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except HttpError as e:
+                if not _is_retryable(e) or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                wait = _backoff_wait(attempt)
+                logger.warning(f"Drive API returned {e.resp.status}, retrying in {wait:.1f}s")
+                time.sleep(wait)
+    return wrapper
+
+
+# PERSISTENT CACHE
+class KeyValueCache:
+    """Thread-safe string key/value store backed by a SQLite table, with an in-memory LRU in front"""
+
+    def __init__(self, path: str, table: str, memory_size: int = 0, max_entries: int = 0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.table = table
+        self.memory_size = memory_size
+        self.max_entries = max_entries  # 0 means unbounded
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                self._remember(key, row[0])
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, value)
+            )
+            if self.max_entries:
+                # Rewritten rows get a new rowid, so the lowest rowids are the stalest entries
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE rowid <= "
+                    f"(SELECT MAX(rowid) FROM {self.table}) - ?", (self.max_entries,)
+                )
+            self._remember(key, value)
+
+    def _remember(self, key: str, value: str):
+        """Add to the in-memory LRU, evicting the least recently used entry (lock held)"""
+        if not self.memory_size:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+
 # GOOGLE DRIVE CLIENT
 class GoogleDriveClient:
     def __init__(self, credentials_path: str):
         self.credentials_path = credentials_path
-        self.service = None
+        self._creds = None
+        self._local = threading.local()
+        self._rate_limiter = RateLimiter(DRIVE_CALLS_PER_SECOND, capacity=DRIVE_CALLS_PER_SECOND)
         self._authenticate()
 
+    @property
+    def service(self):
+        """Drive service for the calling thread (httplib2 is not thread-safe)"""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            # One keep-alive connection per worker thread, reused for every call it makes
+            http = AuthorizedHttp(self._creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            service = build("drive", "v3", http=http, cache_discovery=False)
+            self._local.service = service
+        return service
+
+    @retry_with_backoff
+    def _execute(self, request, cost: int = 1):
+        """Execute a Drive request under the shared rate limit, retrying throttled calls"""
+        # Drive counts every request inside a batch against quota, so a batch costs its size
+        self._rate_limiter.acquire(cost)
+        return request.execute()
+
     def _authenticate(self):
-        creds = None
+        creds = _CREDENTIALS_CACHE.get(self.credentials_path)
 
-        if os.path.exists("token.pickle"):
-            with open("token.pickle", "rb") as token:
-                creds = pickle.load(token)
+        if creds is None and os.path.exists(TOKEN_PATH):
+            with open(TOKEN_PATH, "r") as token:
+                creds = Credentials.from_authorized_user_info(json.load(token), SCOPES)
 
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
@@ -102,10 +339,14 @@ class GoogleDriveClient:
                 )
                 creds = flow.run_local_server(port=0)
 
-            with open("token.pickle", "wb") as token:
-                pickle.dump(creds, token)
+            # Write to a temp file and swap it in so a crash never leaves a half-written token
+            tmp_path = f"{TOKEN_PATH}.tmp"
+            with open(tmp_path, "w") as token:
+                token.write(creds.to_json())
+            os.replace(tmp_path, TOKEN_PATH)
 
-        self.service = build("drive", "v3", credentials=creds)
+        _CREDENTIALS_CACHE[self.credentials_path] = creds
+        self._creds = creds
         logger.info("✓ Authenticated with Google Drive")
 
     def list_files(self, folder_id: str = "root", page_size: int = 100) -> List[FileInfo]:
@@ -114,22 +355,15 @@ class GoogleDriveClient:
 
         try:
             while True:
-                response = self.service.files().list(
+                response = self._execute(self.service.files().list(
                     q=f"'{folder_id}' in parents and trashed=false",
                     pageSize=page_size,
-                    fields="nextPageToken, files(id, name, mimeType, size, createdTime, parents)",
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
                     pageToken=page_token
-                ).execute()
+                ))
 
                 for file in response.get("files", []):
-                    files.append(FileInfo(
-                        id=file["id"],
-                        name=file["name"],
-                        mime_type=file["mimeType"],
-                        size=int(file.get("size", 0)),
-                        created_time=file["createdTime"],
-                        parents=file.get("parents", [])
-                    ))
+                    files.append(self._to_file_info(file))
 
                 page_token = response.get("nextPageToken")
                 if not page_token:
@@ -145,48 +379,158 @@ class GoogleDriveClient:
     def get_file(self, file_id: str) -> Optional[FileInfo]:
         """Get a single file by ID"""
         try:
-            file = self.service.files().get(
+            file = self._execute(self.service.files().get(
                 fileId=file_id,
-                fields="id, name, mimeType, size, createdTime, parents"
-            ).execute()
-            
-            return FileInfo(
-                id=file["id"],
-                name=file["name"],
-                mime_type=file["mimeType"],
-                size=int(file.get("size", 0)),
-                created_time=file["createdTime"],
-                parents=file.get("parents", [])
-            )
+                fields=FILE_FIELDS
+            ))
+
+            return self._to_file_info(file)
         except Exception as e:
             logger.error(f"Error getting file {file_id}: {str(e)}")
             return None
 
-    def create_folder(self, folder_name: str, parent_id: str = "root") -> Optional[str]:
+    @staticmethod
+    def _to_file_info(file: Dict) -> FileInfo:
+        return FileInfo(
+            id=file["id"],
+            name=file["name"],
+            mime_type=file["mimeType"],
+            size=int(file.get("size", 0)),
+            created_time=file["createdTime"],
+            modified_time=file["modifiedTime"],
+            parents=tuple(file.get("parents", []))
+        )
+
+    def get_root_id(self) -> Optional[str]:
+        """Resolve the "root" alias to My Drive's real folder id (parents lists use the real id)"""
         try:
-            # Check if folder exists
-            query = (
-                f"name='{folder_name}' "
-                f"and mimeType='application/vnd.google-apps.folder' "
-                f"and '{parent_id}' in parents and trashed=false"
-            )
+            return self._execute(self.service.files().get(fileId="root", fields="id"))["id"]
+        except Exception as e:
+            logger.error(f"Error resolving root folder id: {str(e)}")
+            return None
+
+    def get_start_page_token(self) -> Optional[str]:
+        """Token marking "now" in the change log; list_changes returns everything after it"""
+        try:
+            return self._execute(self.service.changes().getStartPageToken())["startPageToken"]
+        except Exception as e:
+            logger.error(f"Error getting changes start token: {str(e)}")
+            return None
+
+    def list_changes(self, page_token: str) -> Tuple[List[FileInfo], Optional[str]]:
+        """Files added or modified since page_token, plus the token to resume from next time"""
+        files = []
+
+        try:
+            while True:
+                response = self._execute(self.service.changes().list(
+                    pageToken=page_token,
+                    pageSize=CHANGES_PAGE_SIZE,
+                    includeRemoved=False,
+                    fields=f"nextPageToken, newStartPageToken, changes(file({FILE_FIELDS}, trashed))"
+                ))
+
+                for change in response.get("changes", []):
+                    file = change.get("file")
+                    if file and not file.get("trashed"):
+                        files.append(self._to_file_info(file))
+
+                # The last page carries newStartPageToken instead of nextPageToken
+                if "newStartPageToken" in response:
+                    return files, response["newStartPageToken"]
+                page_token = response["nextPageToken"]
+
+        except Exception as e:
+            logger.error(f"Error listing changes: {str(e)}")
+            return [], None
+
+    def get_live_file_ids(self, file_ids: List[str]) -> Set[str]:
+        """Return the ids not confirmed deleted (404) or trashed, using batched gets"""
+        # Ids whose check fails for any other reason (throttling, 5xx, a failed batch)
+        # are kept, since callers would otherwise forget files that still exist
+        live_ids = set(file_ids)
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                if isinstance(exception, HttpError) and exception.resp.status == 404:
+                    live_ids.discard(request_id)
+            elif response.get("trashed"):
+                live_ids.discard(request_id)
+
+        for start in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+
+            chunk = file_ids[start:start + DRIVE_BATCH_SIZE]
+            for file_id in chunk:
+                batch.add(
+                    self.service.files().get(fileId=file_id, fields="id, trashed"),
+                    request_id=file_id
+                )
+
+            try:
+                self._execute(batch, cost=len(chunk))
+            except Exception as e:
+                logger.error(f"Error executing get batch: {str(e)}")
+
+        return live_ids
+
+    def list_folders(self, parent_id: str = "root") -> Optional[Dict[str, str]]:
+        """Map folder name -> id for every folder directly under parent_id, in one listing"""
+        folders = {}
+        page_token = None
+
+        try:
+            while True:
+                response = self._execute(self.service.files().list(
+                    q=(
+                        f"mimeType='{FOLDER_MIME_TYPE}' "
+                        f"and '{parent_id}' in parents and trashed=false"
+                    ),
+                    pageSize=1000,
+                    fields="nextPageToken, files(id, name)",
+                    pageToken=page_token
+                ))
+
+                for folder in response.get("files", []):
+                    # Keep the first match, as create_folder's own lookup would
+                    folders.setdefault(folder["name"], folder["id"])
+
+                page_token = response.get("nextPageToken")
+                if not page_token:
+                    break
+
+            return folders
+
+        except Exception as e:
+            logger.error(f"Error listing folders: {str(e)}")
+            return None
+
+    def create_folder(self, folder_name: str, parent_id: str = "root", check_existing: bool = True) -> Optional[str]:
+        try:
+            if check_existing:
+                # Check if folder exists
+                query = (
+                    f"name='{folder_name}' "
+                    f"and mimeType='{FOLDER_MIME_TYPE}' "
+                    f"and '{parent_id}' in parents and trashed=false"
+                )
 
-            response = self.service.files().list(q=query, fields="files(id)").execute()
-            folders = response.get("files", [])
+                response = self._execute(self.service.files().list(q=query, fields="files(id)"))
+                folders = response.get("files", [])
 
-            if folders:
-                logger.info(f"Folder '{folder_name}' already exists")
-                return folders[0]["id"]
+                if folders:
+                    logger.info(f"Folder '{folder_name}' already exists")
+                    return folders[0]["id"]
 
             # Create new folder
-            folder = self.service.files().create(
+            folder = self._execute(self.service.files().create(
                 body={
                     "name": folder_name,
-                    "mimeType": "application/vnd.google-apps.folder",
+                    "mimeType": FOLDER_MIME_TYPE,
                     "parents": [parent_id]
                 },
                 fields="id"
-            ).execute()
+            ))
 
             logger.info(f"✓ Created folder '{folder_name}'")
             return folder["id"]
@@ -195,20 +539,21 @@ class GoogleDriveClient:
             logger.error(f"Error creating folder '{folder_name}': {str(e)}")
             return None
 
-    def move_file(self, file_id: str, folder_id: str) -> bool:
+    def move_file(self, file_id: str, folder_id: str, previous_parents: Optional[Sequence[str]] = None) -> bool:
         try:
-            file = self.service.files().get(
-                fileId=file_id, fields="parents"
-            ).execute()
-
-            previous_parents = ",".join(file.get("parents", []))
-
-            self.service.files().update(
+            # Parents are already known from list_files; only look them up if not given
+            if previous_parents is None:
+                file = self._execute(self.service.files().get(
+                    fileId=file_id, fields="parents"
+                ))
+                previous_parents = file.get("parents", [])
+
+            self._execute(self.service.files().update(
                 fileId=file_id,
                 addParents=folder_id,
-                removeParents=previous_parents,
+                removeParents=",".join(previous_parents),
                 fields="id, parents"
-            ).execute()
+            ))
 
             return True
 
@@ -216,7 +561,60 @@ class GoogleDriveClient:
             logger.error(f"Error moving file {file_id}: {str(e)}")
             return False
 
-    def download_file_content(self, file_id: str, mime_type: str) -> Optional[bytes]:
+    def move_files_batch(self, moves: List[Tuple[str, str, Sequence[str]]]) -> Dict[str, bool]:
+        """Move many files using batched requests; moves are (file_id, folder_id, previous_parents)"""
+        results = {file_id: False for file_id, _, _ in moves}
+
+        for start in range(0, len(moves), DRIVE_BATCH_SIZE):
+            pending = moves[start:start + DRIVE_BATCH_SIZE]
+            # retry_with_backoff only sees the outer batch call, so throttled inner
+            # updates are collected and re-sent in a smaller batch after a backoff
+            for attempt in range(RETRY_ATTEMPTS):
+                is_last = attempt == RETRY_ATTEMPTS - 1
+                pending = self._move_batch(pending, results, retry=not is_last)
+                if not pending:
+                    break
+                wait = _backoff_wait(attempt)
+                logger.warning(f"{len(pending)} moves throttled by Drive, retrying in {wait:.1f}s")
+                time.sleep(wait)
+
+        return results
+
+    def _move_batch(self, moves: List[Tuple[str, str, Sequence[str]]], results: Dict[str, bool],
+                    retry: bool) -> List[Tuple[str, str, Sequence[str]]]:
+        """Send one batch of moves, recording successes; returns the throttled moves to retry"""
+        by_id = {move[0]: move for move in moves}
+        throttled = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = True
+            elif retry and isinstance(exception, HttpError) and _is_retryable(exception):
+                throttled.append(by_id[request_id])
+            else:
+                logger.error(f"Error moving file {request_id}: {str(exception)}")
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for file_id, folder_id, previous_parents in moves:
+            batch.add(
+                self.service.files().update(
+                    fileId=file_id,
+                    addParents=folder_id,
+                    removeParents=",".join(previous_parents),
+                    fields="id, parents"
+                ),
+                request_id=file_id
+            )
+
+        try:
+            self._execute(batch, cost=len(moves))
+        except Exception as e:
+            logger.error(f"Error executing move batch: {str(e)}")
+            return []
+
+        return throttled
+
+    def download_file_content(self, file_id: str, mime_type: str, max_bytes: Optional[int] = None) -> Optional[bytes]:
         try:
             if "google-apps" in mime_type:
                 request = self.service.files().export_media(
@@ -225,15 +623,13 @@ class GoogleDriveClient:
                 )
             else:
                 request = self.service.files().get_media(fileId=file_id)
+                if max_bytes:
+                    # Ask Drive for just the leading bytes (206 Partial Content)
+                    request.headers["Range"] = f"bytes=0-{max_bytes - 1}"
 
-            buffer = io.BytesIO()
-            downloader = MediaIoBaseDownload(buffer, request)
-
-            done = False
-            while not done:
-                _, done = downloader.next_chunk()
-
-            return buffer.getvalue()
+            # MediaIoBaseDownload's default chunk is already 100 MiB, so it only ever added
+            # a BytesIO copy; executing the media request returns the body bytes directly
+            return self._execute(request)
 
         except Exception as e:
             logger.error(f"Error downloading file {file_id}: {str(e)}")
@@ -241,75 +637,341 @@ class GoogleDriveClient:
 
 
 # CONTENT EXTRACTION
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+# Extracted text by (content digest, mime type), so identical bytes are parsed once per process
+_extract_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_extract_cache_lock = threading.Lock()
+
+
+def _extract_pdf_text(content: bytes) -> str:
+    """Extract preview text from a PDF (module-level so worker processes can run it)"""
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        text = ""
+        for i in range(min(PDF_MAX_PAGES, doc.page_count)):
+            text += doc[i].get_text("text")
+            # First pages usually fill the preview; skip parsing the rest
+            if len(text) >= MAX_CONTENT_LENGTH:
+                break
+    return text[:MAX_CONTENT_LENGTH]
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Lazily start the shared process pool for CPU-bound PDF parsing"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn rather than fork: forking while worker threads hold locks can deadlock
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+
+def _discard_pdf_pool(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died so the next PDF starts a fresh one"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        # Another thread may already have replaced it
+        if _pdf_pool is broken:
+            _pdf_pool = None
+    broken.shutdown(wait=False)
+
+
 class ContentExtractor:
 
     @staticmethod
-    def extract(content: bytes, mime_type: str, filename: str) -> str:
+    def extract(content: bytes, mime_type: str) -> Optional[str]:
+        """Text preview of a file, or None if its type has no parser or parsing failed"""
+        key = (hashlib.blake2b(content, digest_size=16).hexdigest(), mime_type)
+        with _extract_cache_lock:
+            if key in _extract_cache:
+                _extract_cache.move_to_end(key)
+                return _extract_cache[key]
+
+        kind = ContentExtractor._kind(mime_type)
         try:
-            if "pdf" in mime_type:
-                return ContentExtractor._from_pdf(content)
-            elif "word" in mime_type or "document" in mime_type:
-                return ContentExtractor._from_docx(content)
-            elif "sheet" in mime_type or "excel" in mime_type:
-                return ContentExtractor._from_excel(content)
-            elif "text" in mime_type:
-                return content.decode("utf-8", errors="ignore")[:MAX_CONTENT_LENGTH]
+            if kind == "pdf":
+                text = ContentExtractor._from_pdf(content)
+            elif kind == "docx":
+                text = ContentExtractor._from_docx(content)
+            elif kind == "xlsx":
+                text = ContentExtractor._from_excel(content)
+            elif kind == "text":
+                # Bounds Google Docs/Slides exports, which can't be range-limited, and any
+                # server that ignores Range (UTF-8 is at most 4 bytes/char)
+                text = content[:MAX_CONTENT_LENGTH * 4].decode("utf-8", errors="ignore")[:MAX_CONTENT_LENGTH]
             else:
-                return f"Filename: {filename}"
+                return None
         except Exception as e:
             logger.error(f"Error extracting content: {str(e)}")
-            return f"Filename: {filename}"
+            return None
+
+        with _extract_cache_lock:
+            _extract_cache[key] = text
+            if len(_extract_cache) > EXTRACT_MEMORY_CACHE_SIZE:
+                _extract_cache.popitem(last=False)
+        return text
+
+    @staticmethod
+    def download_limit(mime_type: str) -> Optional[int]:
+        """Bytes extract() needs from a file: None for the whole file, 0 for none at all"""
+        # PDF xref tables and DOCX/XLSX zip directories sit at the end of the file,
+        # so those formats cannot be parsed from a truncated prefix
+        kind = ContentExtractor._kind(mime_type)
+        if kind in ("pdf", "docx", "xlsx"):
+            return None
+        elif kind == "text":
+            return MAX_CONTENT_LENGTH * 4  # UTF-8 uses at most 4 bytes per character
+        else:
+            return 0  # Classified from the filename only
+
+    @staticmethod
+    def _kind(mime_type: str) -> Optional[str]:
+        """Which parser extract() uses for a MIME type, or None if it has none"""
+        if mime_type.startswith("text/"):
+            return "text"
+        return EXTRACTABLE_MIME_TYPES.get(mime_type)
 
     @staticmethod
     def _from_pdf(content: bytes) -> str:
-        reader = PyPDF2.PdfReader(io.BytesIO(content))
-        text = ""
-        for page in reader.pages[:5]:
-            text += page.extract_text() or ""
-        return text[:MAX_CONTENT_LENGTH]
+        # Large PDFs are parsed in a separate process so organize workers don't contend on the GIL
+        if len(content) >= PDF_PROCESS_MIN_BYTES:
+            # A crashed worker (e.g. MuPDF on a malformed file) breaks the whole pool, possibly
+            # while parsing another file, so retry once on a fresh pool before giving up
+            for attempt in range(2):
+                pool = _get_pdf_pool()
+                try:
+                    return pool.submit(_extract_pdf_text, content).result()
+                except BrokenProcessPool:
+                    _discard_pdf_pool(pool)
+                    if attempt:
+                        raise
+        return _extract_pdf_text(content)
 
     @staticmethod
     def _from_docx(content: bytes) -> str:
-        doc = Document(io.BytesIO(content))
-        return "\n".join(p.text for p in doc.paragraphs)[:MAX_CONTENT_LENGTH]
+        # Stream word/document.xml straight from the zip and stop once the preview is full,
+        # instead of building python-docx's object model for the whole document
+        parts = []
+        length = 0
+        with zipfile.ZipFile(io.BytesIO(content)) as docx:
+            with docx.open("word/document.xml") as xml:
+                for _, elem in ElementTree.iterparse(xml):
+                    if elem.tag == W_NS + "t" and elem.text:
+                        parts.append(elem.text)
+                        length += len(elem.text)
+                    elif elem.tag == W_NS + "tab":
+                        parts.append("\t")
+                    elif elem.tag == W_NS + "p":
+                        parts.append("\n")
+                        length += 1
+                        elem.clear()
+                        if length >= MAX_CONTENT_LENGTH:
+                            break
+        return "".join(parts)[:MAX_CONTENT_LENGTH]
 
     @staticmethod
     def _from_excel(content: bytes) -> str:
-        wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
-        sheet = wb.active
-        text = "Sheets: " + ", ".join(wb.sheetnames) + "\n"
-        text += " ".join(
-            str(cell.value) for row in list(sheet.iter_rows(max_row=20))
-            for cell in row if cell.value
-        )
+        # read_only streams rows on demand instead of loading every sheet up front
+        wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True, read_only=True)
+        try:
+            sheet = wb.active
+            values = []
+            length = 0
+            # values_only yields plain tuples, skipping Cell object construction
+            for row in sheet.iter_rows(max_row=20, values_only=True):
+                for value in row:
+                    if value:
+                        values.append(str(value))
+                        length += len(values[-1]) + 1
+                if length >= MAX_CONTENT_LENGTH:
+                    break
+            text = "Sheets: " + ", ".join(wb.sheetnames) + "\n" + " ".join(values)
+        finally:
+            # Read-only workbooks keep the underlying zip open until closed
+            wb.close()
         return text[:MAX_CONTENT_LENGTH]
 
 
+# RULE ROUTER
+class RuleRouter:
+    """Routes files whose names are decisive, without downloading them or calling the LLM"""
+
+    # Kept short and high-precision: every term must stand as a whole word (optionally
+    # plural), so "q4_invoice.pdf" and "receipts" match but "noninvoice" and "resumed" don't.
+    # Group names must be valid category names.
+    CATEGORY_PATTERNS = {
+        "Finance": r"invoice|receipt|payslip|salary[ _-]?slip|bank[ _-]?statement|tax[ _-]?return",
+        "HR": r"resume|curriculum[ _-]?vitae|offer[ _-]?letter|performance[ _-]?appraisal",
+        "Academics": r"syllabus|academic[ _-]?transcript",
+    }
+    CONFIDENCE = 0.95
+
+    # One alternation compiled at import, so each filename is scanned once for all categories
+    _PATTERN = re.compile(
+        "|".join(
+            f"(?P<{category}>(?<![a-z])(?:{pattern})s?(?![a-z]))"
+            for category, pattern in CATEGORY_PATTERNS.items()
+        ),
+        re.IGNORECASE
+    )
+
+    @classmethod
+    def classify(cls, filename: str) -> Optional[Classification]:
+        match = cls._PATTERN.search(filename)
+        if not match:
+            return None
+
+        return Classification(
+            category=match.lastgroup,
+            confidence=cls.CONFIDENCE,
+            reasoning=f"Filename matches rule '{match.group(0)}'"
+        )
+
+
 # AI CLASSIFIER
+# Static instructions go in the system message, byte-identical across calls, so the
+# provider can reuse the cached prompt prefix; only the per-file details vary.
+# Every prompt opens with the same PROMPT_PREFIX, so single and batch calls to the
+# same model hit one cached prefix.
+PROMPT_PREFIX = f"""Classify files into ONE category each from:
+{', '.join(CATEGORIES)}
+
+A classification is a JSON object:
+{{
+  "category": "one of the categories above",
+  "confidence": 0.0-1.0,
+  "reasoning": "brief explanation",
+  "subcategory": "optional subcategory"
+}}
+"""
+
+CLASSIFY_SYSTEM_PROMPT = PROMPT_PREFIX + """
+The user describes one file. Return ONLY its classification as valid JSON
+(no markdown, no explanations)."""
+
+METADATA_SYSTEM_PROMPT = PROMPT_PREFIX + """
+The user describes one file by its metadata only. Use a high confidence only
+when the name alone makes the category unambiguous. Return ONLY its
+classification as valid JSON (no markdown, no explanations)."""
+
+BATCH_SYSTEM_PROMPT = PROMPT_PREFIX + """
+The user describes several files as a JSON array. Return ONLY a valid JSON
+array with one classification per file, each with an added "id" field copied
+from its file (no markdown, no explanations)."""
+
+METADATA_BATCH_SYSTEM_PROMPT = PROMPT_PREFIX + """
+The user describes several files by their metadata only, as a JSON array. Use
+a high confidence only when a name alone makes the category unambiguous.
+Return ONLY a valid JSON array with one classification per file, each with an
+added "id" field copied from its file (no markdown, no explanations)."""
+
+
+# Outermost JSON object/array in a reply (greedy, across newlines)
+JSON_OBJECT_RE = re.compile(rb"\{.*\}", re.S)
+JSON_ARRAY_RE = re.compile(rb"\[.*\]", re.S)
+
+
 class AIClassifier:
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_path: str = CLASSIFICATION_CACHE_PATH):
+        # The Groq client itself backs off and retries on 429/5xx responses
         self.llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
+            model=LLM_MODEL,
+            groq_api_key=api_key,
+            temperature=0,
+            max_retries=RETRY_ATTEMPTS
+        )
+        self.metadata_llm = ChatGroq(
+            model=METADATA_LLM_MODEL,
             groq_api_key=api_key,
-            temperature=0
+            temperature=0,
+            max_retries=RETRY_ATTEMPTS
         )
+        self.cache = KeyValueCache(cache_path, "classifications", memory_size=CLASSIFICATION_MEMORY_CACHE_SIZE)
+        self._rate_limiter = RateLimiter(GROQ_CALLS_PER_SECOND, capacity=GROQ_CALLS_PER_SECOND)
 
     def classify(self, file: FileInfo, content: str) -> Classification:
+        return self._classify(
+            self.llm,
+            self._prompt(file, content),
+            self._cache_key(LLM_MODEL, file, content)
+        )
+
+    def classify_by_metadata(self, file: FileInfo) -> Classification:
+        """Cheap classification from name and MIME type only, before any download"""
+        return self._classify(
+            self.metadata_llm,
+            self._metadata_prompt(file),
+            self._cache_key(METADATA_LLM_MODEL, file, "")
+        )
+
+    def classify_batch(self, files_and_contents: List[Tuple[FileInfo, str]]) -> List[Classification]:
+        """Classify several files with one LLM call; results follow the input order"""
+        return self._classify_many(
+            self.llm,
+            files_and_contents,
+            [
+                self._cache_key(LLM_MODEL, file, content, BATCH_PREVIEW_LENGTH)
+                for file, content in files_and_contents
+            ],
+            self._batch_prompt,
+            lambda item: self.classify(*item)
+        )
+
+    def classify_by_metadata_batch(self, files: List[FileInfo]) -> List[Classification]:
+        """Metadata pre-pass for several files with one call; results follow the input order"""
+        return self._classify_many(
+            self.metadata_llm,
+            files,
+            [self._cache_key(METADATA_LLM_MODEL, file, "") for file in files],
+            self._metadata_batch_prompt,
+            self.classify_by_metadata
+        )
+
+    def _classify_many(self, llm: ChatGroq, items: list, keys: List[str], build_prompt, classify_one) -> List[Classification]:
+        """Send uncached items as one id-numbered JSON array, falling back to one call per bad entry"""
+        results = [self._cached(key) for key in keys]
+        misses = [idx for idx, result in enumerate(results) if result is None]
+
+        if not misses:
+            return results
+
         try:
-            prompt = self._prompt(file, content)
-            response = self.llm.invoke(prompt).content.strip()
-            
-            # Clean up response
-            response = response.strip("```json").strip("```").strip()
-            result = json.loads(response)
+            prompt = build_prompt([items[idx] for idx in misses])
+            self._rate_limiter.acquire()
+            response = llm.invoke(prompt).content
+            by_id = {str(item["id"]): item for item in self._extract_json(response, JSON_ARRAY_RE)}
 
-            return Classification(
-                category=result["category"],
-                confidence=float(result["confidence"]),
-                reasoning=result["reasoning"],
-                subcategory=result.get("subcategory")
-            )
+        except Exception as e:
+            logger.error(f"Error classifying batch: {str(e)}")
+            by_id = {}
+
+        for position, idx in enumerate(misses, 1):
+            try:
+                classification = self._parse(by_id[str(position)])
+            except Exception:
+                # Missing or malformed entry: fall back to classifying this item alone
+                results[idx] = classify_one(items[idx])
+                continue
+
+            self._store(keys[idx], classification)
+            results[idx] = classification
+
+        return results
+
+    def _classify(self, llm: ChatGroq, prompt: List[BaseMessage], key: str) -> Classification:
+        cached = self._cached(key)
+        if cached:
+            return cached
+
+        try:
+            self._rate_limiter.acquire()
+            response = llm.invoke(prompt).content
+            classification = self._parse(self._extract_json(response, JSON_OBJECT_RE))
 
         except Exception as e:
             logger.error(f"Error classifying file: {str(e)}")
@@ -319,26 +981,91 @@ class AIClassifier:
                 reasoning=f"Classification error: {str(e)}"
             )
 
-    def _prompt(self, file: FileInfo, content: str) -> str:
-        return f"""
-Classify this file into ONE category from:
-{', '.join(CATEGORIES)}
+        # Only successful classifications are cached so errors get retried
+        self._store(key, classification)
+        return classification
+
+    @staticmethod
+    def _extract_json(response: str, pattern: re.Pattern):
+        """Decode the JSON payload of an LLM reply, ignoring markdown fences or surrounding prose"""
+        match = pattern.search(response.encode("utf-8"))
+        if not match:
+            raise ValueError(f"No JSON found in response: {response[:200]!r}")
+        return orjson.loads(match.group(0))
+
+    @staticmethod
+    def _parse(result: Dict) -> Classification:
+        return Classification(
+            category=result["category"],
+            confidence=float(result["confidence"]),
+            reasoning=result["reasoning"],
+            subcategory=result.get("subcategory")
+        )
+
+    def _cached(self, key: str) -> Optional[Classification]:
+        cached = self.cache.get(key)
+        return Classification(**orjson.loads(cached)) if cached else None
 
-File name: {file.name}
+    def _store(self, key: str, classification: Classification):
+        self.cache.set(key, orjson.dumps(asdict(classification)).decode("utf-8"))
+
+    @staticmethod
+    def _cache_key(model: str, file: FileInfo, content: str, preview_length: int = MAX_CONTENT_LENGTH) -> str:
+        """Hash of everything the prompt depends on; the model name invalidates entries on upgrade"""
+        # The preview length is part of the key, so batch verdicts (decided on a short
+        # preview) are never served to a full-preview classify() of the same file
+        content = unicodedata.normalize("NFC", content[:preview_length].strip())
+        parts = (model, str(preview_length), file.name.strip(), file.mime_type, content)
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _prompt(self, file: FileInfo, content: str) -> List[BaseMessage]:
+        return [
+            SystemMessage(content=CLASSIFY_SYSTEM_PROMPT),
+            HumanMessage(content=f"""File name: {file.name}
 Type: {file.mime_type}
 Size: {file.size} bytes
 
 Content preview:
-{content[:MAX_CONTENT_LENGTH]}
-
-Return ONLY valid JSON (no markdown, no explanations):
-{{
-  "category": "one of the categories above",
-  "confidence": 0.0-1.0,
-  "reasoning": "brief explanation",
-  "subcategory": "optional subcategory"
-}}
-"""
+{content[:MAX_CONTENT_LENGTH]}""")
+        ]
+
+    def _batch_prompt(self, files_and_contents: List[Tuple[FileInfo, str]]) -> List[BaseMessage]:
+        # Fixed per-file budget (a full batch splits the single-file one), so cache keys
+        # can be computed before knowing how many files miss the cache
+        entries = [
+            {
+                "id": str(idx),
+                "name": file.name,
+                "mime": file.mime_type,
+                "size": file.size,
+                "content_preview": content[:BATCH_PREVIEW_LENGTH]
+            }
+            for idx, (file, content) in enumerate(files_and_contents, 1)
+        ]
+
+        return [
+            SystemMessage(content=BATCH_SYSTEM_PROMPT),
+            HumanMessage(content=f"Files (JSON array):\n{json.dumps(entries, ensure_ascii=False)}")
+        ]
+
+    def _metadata_batch_prompt(self, files: List[FileInfo]) -> List[BaseMessage]:
+        entries = [
+            {"id": str(idx), "name": file.name, "mime": file.mime_type, "size": file.size}
+            for idx, file in enumerate(files, 1)
+        ]
+
+        return [
+            SystemMessage(content=METADATA_BATCH_SYSTEM_PROMPT),
+            HumanMessage(content=f"Files (JSON array):\n{json.dumps(entries, ensure_ascii=False)}")
+        ]
+
+    def _metadata_prompt(self, file: FileInfo) -> List[BaseMessage]:
+        return [
+            SystemMessage(content=METADATA_SYSTEM_PROMPT),
+            HumanMessage(content=f"""File name: {file.name}
+Type: {file.mime_type}
+Size: {file.size} bytes""")
+        ]
 
 
 # WEBHOOK HANDLERS
@@ -356,8 +1083,9 @@ def drive_webhook():
         
         # Only process 'change' or 'update' notifications
         if resource_state in ['change', 'update']:
-            # Process in background thread to respond quickly
-            threading.Thread(target=process_new_files, daemon=True).start()
+            # Process in the background to respond quickly; bursts coalesce into one scan
+            _scan_requested.set()
+            WEBHOOK_POOL.submit(_drain_scan_requests)
         
         return 'OK', 200
         
@@ -366,6 +1094,24 @@ def drive_webhook():
         return 'Error', 500
 
 
+def _drain_scan_requests():
+    """Scan for new files until no notification arrived during the last scan"""
+    while True:
+        # A scan already in progress will pick up this request
+        if not _scan_lock.acquire(blocking=False):
+            return
+        try:
+            while _scan_requested.is_set():
+                _scan_requested.clear()
+                process_new_files()
+        finally:
+            _scan_lock.release()
+
+        # Catch a notification that landed between the last check and the release
+        if not _scan_requested.is_set():
+            return
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -384,30 +1130,23 @@ def process_new_files():
         
     try:
         logger.info("Checking for new files to organize...")
-        
-        # Get all files in root
-        files = organizer_instance.drive.list_files("root")
-        organized_count = 0
-        
-        for file in files:
-            # Skip if file type should be skipped
-            if organizer_instance._should_skip_file(file):
-                continue
-            
-            # Skip if already in a category folder
-            if organizer_instance._is_organized(file):
-                continue
-            
-            # Organize this file
-            try:
-                organized = organizer_instance.organize_single_file(file)
-                if organized:
-                    organized_count += 1
-            except Exception as e:
-                logger.error(f"Error organizing file '{file.name}': {str(e)}")
-                continue
-                
-            time.sleep(0.5)  # Rate limiting
+
+        next_token = None
+        if organizer_instance.change_token and organizer_instance.root_id:
+            # Only files added or modified since the last notification, not the whole root
+            changed, next_token = organizer_instance.drive.list_changes(organizer_instance.change_token)
+            if next_token is None:
+                return  # Error already logged; the same token is retried on the next notification
+            files = organizer_instance.files_to_retry(changed)
+        else:
+            # Change tracking could not be started, so fall back to scanning all of root
+            files = organizer_instance.drive.list_files("root")
+
+        stats = organizer_instance.organize_tracked(files)
+        organized_count = stats['organized']
+
+        if next_token:
+            organizer_instance.change_token = next_token
         
         if organized_count > 0:
             logger.info(f"✓ Organized {organized_count} new file(s)")
@@ -416,6 +1155,8 @@ def process_new_files():
             
     except Exception as e:
         logger.error(f"Error processing new files: {str(e)}")
+    finally:
+        flush_logs()
 
 
 # DRIVE ORGANIZER
@@ -424,97 +1165,215 @@ class DriveOrganizer:
     def __init__(self, credentials_path: str, groq_api_key: str):
         self.drive = GoogleDriveClient(credentials_path)
         self.classifier = AIClassifier(groq_api_key)
+        # Extracted text keyed by file id + modifiedTime, so dry run → live run
+        # (or a re-run after prompt changes) reuses it without re-downloading
+        self.content_cache = KeyValueCache(
+            CONTENT_CACHE_PATH, "contents", max_entries=CONTENT_CACHE_MAX_ENTRIES
+        )
         self.folders: Dict[str, str] = {}
-        self.organized_file_ids = set()  # Track organized files
+        self._folder_ids: FrozenSet[str] = frozenset()  # Category folder ids for O(1) parent checks
+        self._lock = threading.Lock()  # Guards folders/organized_file_ids/_db across workers
+        # One pool for the organizer's lifetime: its threads keep their Drive service and
+        # keep-alive connection between webhook passes instead of reconnecting each time
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+        # Webhook mode: position in the Drive change log, and root's real id to filter changes by
+        self.change_token: Optional[str] = None
+        self.root_id: Optional[str] = None
+        self.retry_files: Dict[str, FileInfo] = {}  # Failed files from earlier passes, by id
+
+        # Organized file ids survive restarts so earlier runs' files are not re-checked
+        self._db = sqlite3.connect(STATE_DB_PATH, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS organized (file_id TEXT PRIMARY KEY)")
+        self.organized_file_ids = {
+            row[0] for row in self._db.execute("SELECT file_id FROM organized")
+        }
+
+    def start_change_tracking(self) -> bool:
+        """Start following the Drive change log from now; False if webhooks must rescan root"""
+        self.root_id = self.drive.get_root_id()
+        self.change_token = self.drive.get_start_page_token()
+        return bool(self.root_id and self.change_token)
+
+    def files_to_retry(self, changed: List[FileInfo]) -> List[FileInfo]:
+        """Changed files still in root, plus earlier failures that were not deleted or moved away"""
+        pending = dict(self.retry_files)
+        if pending:
+            live_ids = self.drive.get_live_file_ids(list(pending))
+            pending = {file_id: f for file_id, f in pending.items() if file_id in live_ids}
+
+        # A fresher copy from the change log wins; files moved out of root are dropped
+        for file in changed:
+            if self.root_id in file.parents:
+                pending[file.id] = file
+            else:
+                pending.pop(file.id, None)
+        return list(pending.values())
+
+    def organize_tracked(self, files: List[FileInfo]) -> Dict[str, int]:
+        """Organize files in webhook mode, keeping any that fail for the next pass"""
+        # Same concurrent pipeline as batch mode; skipped files are expected here
+        stats = self.organize_files(files, log_skipped=False)
+
+        # The change token moves past these files, so they would otherwise never be retried
+        self.retry_files = {
+            f.id: f for f in files
+            if not self._should_skip_file(f) and not self._is_organized(f)
+        }
+        return stats
+
+    def _mark_organized(self, file_ids: List[str]):
+        """Record files as organized, in memory and in the state database"""
+        with self._lock, self._db:
+            self.organized_file_ids.update(file_ids)
+            self._db.executemany(
+                "INSERT OR IGNORE INTO organized (file_id) VALUES (?)",
+                [(file_id,) for file_id in file_ids]
+            )
 
     def _should_skip_file(self, file: FileInfo) -> bool:
         """Check if file should be skipped"""
-        # Skip folders
-        if file.mime_type == "application/vnd.google-apps.folder":
-            return True
-        
-        # Skip images, videos, audio
-        for prefix in SKIP_MIME_PREFIXES:
-            if file.mime_type.startswith(prefix):
-                return True
-        
-        return False
+        # Skip folders, then images, videos, audio (startswith takes the whole tuple)
+        return (
+            file.mime_type in SKIP_MIME_TYPES
+            or file.mime_type.startswith(SKIP_MIME_PREFIXES)
+        )
 
     def _is_organized(self, file: FileInfo) -> bool:
         """Check if file is already in a category folder"""
-        # Check if in tracking set
-        if file.id in self.organized_file_ids:
-            return True
-        
-        # Check if parent is one of our category folders
-        for parent_id in file.parents:
-            if parent_id in self.folders.values():
-                self.organized_file_ids.add(file.id)
+        with self._lock:
+            # Check if in tracking set
+            if file.id in self.organized_file_ids:
                 return True
+            folder_ids = self._folder_ids
+            
+        # Check if parent is one of our category folders
+        if any(parent_id in folder_ids for parent_id in file.parents):
+            self._mark_organized([file.id])
+            return True
         
         return False
 
     def setup_folders(self, root_folder_id: str = "root"):
         """Create all category folders"""
         logger.info("Setting up category folders...")
+
+        folder_cache = self._load_folder_cache()
+        cached = folder_cache.get(root_folder_id, {})
+
+        # Drop cached ids whose folders were deleted or trashed since the last run
+        live_ids = self.drive.get_live_file_ids(list(cached.values()))
+        folders = {name: folder_id for name, folder_id in cached.items() if folder_id in live_ids}
         
-        for category in CATEGORIES + ["Needs Review"]:
-            folder_id = self.drive.create_folder(category, root_folder_id)
-            if folder_id:
-                self.folders[category] = folder_id
+        missing = [category for category in CATEGORIES + ["Needs Review"] if category not in folders]
+        if missing:
+            # One listing of the root's folders instead of an existence query per category
+            existing = self.drive.list_folders(root_folder_id)
+
+            for category in missing:
+                if existing and category in existing:
+                    folders[category] = existing[category]
+                    continue
+                # If the listing failed, fall back to create_folder's own existence check
+                folder_id = self.drive.create_folder(
+                    category, root_folder_id, check_existing=existing is None
+                )
+                if folder_id:
+                    folders[category] = folder_id
+
+        with self._lock:
+            self.folders.update(folders)
+            self._folder_ids = frozenset(self.folders.values())
+
+        folder_cache[root_folder_id] = folders
+        self._save_folder_cache(folder_cache)
         
         logger.info(f"✓ Created/verified {len(self.folders)} category folders")
 
-    def organize_single_file(self, file: FileInfo) -> bool:
-        """Organize a single file"""
+    @staticmethod
+    def _load_folder_cache() -> Dict[str, Dict[str, str]]:
+        """Load the root folder id -> {category: folder id} map from previous runs"""
+        if not os.path.exists(FOLDER_CACHE_PATH):
+            return {}
         try:
-            # Download and extract content
-            content_bytes = self.drive.download_file_content(file.id, file.mime_type)
-            
-            if content_bytes:
-                content = ContentExtractor.extract(content_bytes, file.mime_type, file.name)
-            else:
-                content = f"Filename: {file.name}"
-            
-            # Classify
-            classification = self.classifier.classify(file, content)
-            
-            # Determine destination
-            destination = (
-                classification.category
-                if classification.confidence >= CONFIDENCE_THRESHOLD
-                else "Needs Review"
-            )
-            
-            # Move file
+            with open(FOLDER_CACHE_PATH, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading folder cache: {str(e)}")
+            return {}
+
+    @staticmethod
+    def _save_folder_cache(folder_cache: Dict[str, Dict[str, str]]):
+        try:
+            tmp_path = f"{FOLDER_CACHE_PATH}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(folder_cache, f, indent=2)
+            os.replace(tmp_path, FOLDER_CACHE_PATH)
+        except OSError as e:
+            logger.error(f"Error writing folder cache: {str(e)}")
+
+    def _extract_content(self, file: FileInfo) -> str:
+        """Download and extract a text preview of the file"""
+        fallback = f"Filename: {file.name}"
+        max_bytes = ContentExtractor.download_limit(file.mime_type)
+        if max_bytes == 0:
+            return fallback
+
+        cache_key = f"{file.id}:{file.modified_time}"
+        content = self.content_cache.get(cache_key)
+        # Older runs also cached the fallback; treat it as a miss so extraction is retried
+        if content is not None and content != fallback:
+            return content
+
+        content_bytes = self.drive.download_file_content(file.id, file.mime_type, max_bytes)
+        content = ContentExtractor.extract(content_bytes, file.mime_type) if content_bytes else None
+        if content is None:
+            return fallback  # Not cached, so a later run (or extractor fix) tries again
+
+        self.content_cache.set(cache_key, content)
+        return content
+
+    @staticmethod
+    def _destination(classification: Classification) -> str:
+        return (
+            classification.category
+            if classification.confidence >= CONFIDENCE_THRESHOLD
+            else "Needs Review"
+        )
+
+    def organize_single_file(self, file: FileInfo) -> bool:
+        """Organize a single file through the same pipeline as batches"""
+        return self.organize_files([file])['organized'] == 1
+
+    @staticmethod
+    def _groups(items: list, size: int) -> List[list]:
+        return [items[start:start + size] for start in range(0, len(items), size)]
+
+    def _move_classified(self, resolved: List[Tuple[FileInfo, Classification, str]], stats: Dict[str, int]):
+        """Move classified files to their category folders in Drive batches"""
+        moves = []
+        for file, _, destination in resolved:
             destination_folder_id = self.folders.get(destination)
             if not destination_folder_id:
                 logger.error(f"Destination folder not found: {destination}")
-                return False
-            
-            success = self.drive.move_file(file.id, destination_folder_id)
-            
-            if success:
-                self.organized_file_ids.add(file.id)
+                stats['errors'] += 1
+                continue
+            moves.append((file.id, destination_folder_id, file.parents))
+
+        results = self.drive.move_files_batch(moves)
+
+        self._mark_organized([file_id for file_id, moved in results.items() if moved])
+
+        for file, classification, destination in resolved:
+            if results.get(file.id):
                 logger.info(f"✓ Moved '{file.name}' → {destination} (confidence: {classification.confidence:.2f})")
-                return True
-            else:
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error organizing file '{file.name}': {str(e)}")
-            return False
+                stats['organized'] += 1
+            elif file.id in results:
+                stats['errors'] += 1
 
-    def organize_batch(self, root_folder_id: str = "root", dry_run: bool = False):
-        """Organize all files in a folder (one-time batch operation)"""
-        logger.info(f"Starting batch organization (dry_run={dry_run})")
-        
-        # Setup folders
-        self.setup_folders(root_folder_id)
-        
-        # Get all files
-        files = self.drive.list_files(root_folder_id)
-        
+    def organize_files(self, files: List[FileInfo], dry_run: bool = False, log_skipped: bool = True) -> Dict[str, int]:
+        """Classify and move files concurrently, returning organize stats"""
         stats = {
             'total': len(files),
             'organized': 0,
@@ -525,43 +1384,88 @@ class DriveOrganizer:
         
         logger.info(f"Processing {stats['total']} files...")
         
-        for idx, file in enumerate(files, 1):
-            logger.info(f"[{idx}/{stats['total']}] Processing: {file.name}")
-            
+        pending = []
+        for file in files:
             # Skip if should be skipped
             if self._should_skip_file(file):
-                logger.info(f"  → Skipped ({file.mime_type})")
+                if log_skipped:
+                    logger.info(f"Skipped '{file.name}' ({file.mime_type})")
                 stats['skipped'] += 1
                 continue
             
             # Skip if already organized
             if self._is_organized(file):
-                logger.info(f"  → Already organized")
+                if log_skipped:
+                    logger.info(f"Skipped '{file.name}' (already organized)")
                 stats['skipped'] += 1
                 continue
-            
-            try:
-                if not dry_run:
-                    success = self.organize_single_file(file)
-                    if success:
-                        stats['organized'] += 1
-                    else:
-                        stats['errors'] += 1
+
+            pending.append(file)
+
+        resolved: List[Tuple[FileInfo, Classification, str]] = []
+        ambiguous: List[FileInfo] = []
+        for file in pending:
+            # Decisive filenames need neither a download nor an LLM call
+            classification = RuleRouter.classify(file.name)
+            if classification and classification.confidence >= CONFIDENCE_THRESHOLD:
+                resolved.append((file, classification, classification.category))
+            else:
+                ambiguous.append(file)
+
+        to_classify: List[Tuple[FileInfo, str]] = []
+        # Metadata pre-pass, several names per small-model call; confident matches skip the download
+        to_extract: List[FileInfo] = []
+        groups = self._groups(ambiguous, METADATA_BATCH_SIZE)
+        for group, classifications in zip(groups, self._executor.map(self.classifier.classify_by_metadata_batch, groups)):
+            for file, classification in zip(group, classifications):
+                if classification.confidence >= METADATA_CONFIDENCE_THRESHOLD:
+                    resolved.append((file, classification, classification.category))
                 else:
-                    # Dry run - just classify
-                    content_bytes = self.drive.download_file_content(file.id, file.mime_type)
-                    content = ContentExtractor.extract(content_bytes, file.mime_type, file.name) if content_bytes else f"Filename: {file.name}"
-                    classification = self.classifier.classify(file, content)
-                    
-                    destination = classification.category if classification.confidence >= CONFIDENCE_THRESHOLD else "Needs Review"
-                    logger.info(f"  → [DRY RUN] Would move to '{destination}' (confidence: {classification.confidence:.2f})")
-                    stats['organized'] += 1
-                    
+                    to_extract.append(file)
+
+        futures = {
+            self._executor.submit(self._extract_content, file): file
+            for file in to_extract
+        }
+
+        for idx, future in enumerate(as_completed(futures), 1):
+            file = futures[future]
+            try:
+                to_classify.append((file, future.result()))
             except Exception as e:
-                logger.error(f"  → Error: {str(e)}")
+                logger.error(f"  → Error processing '{file.name}': {str(e)}")
                 stats['errors'] += 1
-                
-            time.sleep(0.5)  # Rate limiting
+
+            logger.debug("[%d/%d] Prepared: %s", idx, len(to_extract), file.name)
+
+        # Classify the remaining files by content, several per LLM call
+        groups = self._groups(to_classify, CLASSIFY_BATCH_SIZE)
+        for group, classifications in zip(groups, self._executor.map(self.classifier.classify_batch, groups)):
+            for (file, _), classification in zip(group, classifications):
+                resolved.append((file, classification, self._destination(classification)))
+
+        # One log record per file: dry run reports here, live runs once the move lands
+        if dry_run:
+            if logger.isEnabledFor(logging.INFO):
+                for file, classification, destination in resolved:
+                    logger.info(f"[DRY RUN] Would move '{file.name}' → {destination} (confidence: {classification.confidence:.2f})")
+            stats['organized'] += len(resolved)
+        else:
+            self._move_classified(resolved, stats)
+
+        return stats
+
+    def organize_batch(self, root_folder_id: str = "root", dry_run: bool = False):
+        """Organize all files in a folder (one-time batch operation)"""
+        logger.info(f"Starting batch organization (dry_run={dry_run})")
+        
+        # Setup folders
+        self.setup_folders(root_folder_id)
+        
+        # Get all files
+        files = self.drive.list_files(root_folder_id)
+        
+        stats = self.organize_files(files, dry_run=dry_run)
         
         # Print summary
         logger.info("\n" + "="*60)
@@ -572,6 +1476,7 @@ class DriveOrganizer:
         logger.info(f"Skipped: {stats['skipped']}")
         logger.info(f"Errors: {stats['errors']}")
         logger.info("="*60 + "\n")
+        flush_logs()
 
 
 # WEBHOOK SERVER
@@ -633,14 +1538,17 @@ class WebhookServer:
                 logger.error(f"Error stopping webhook: {str(e)}")
     
     def run_server(self, host: str = '0.0.0.0', port: int = 5000):
-        """Start Flask webhook server"""
+        """Start the webhook server (waitress WSGI server)"""
         logger.info(f"Starting webhook server on {host}:{port}")
         logger.info(f"Webhook endpoint: {self.webhook_url}")
         logger.info("Press Ctrl+C to stop\n")
         
         try:
-            app.run(host=host, port=port, debug=False)
+            # waitress handles Ctrl+C itself and returns, so clean up in finally
+            serve(app, host=host, port=port, threads=WEBHOOK_SERVER_THREADS)
         except KeyboardInterrupt:
+            pass
+        finally:
             logger.info("\nShutting down...")
             self.stop_watching()
 
@@ -697,6 +1605,15 @@ if __name__ == "__main__":
         
         # Setup folders first
         organizer.setup_folders("root")
+
+        # Webhooks then only fetch changes made after this point. The token is taken
+        # before the sweep below, so files added while it runs still arrive as changes.
+        if not organizer.start_change_tracking():
+            print("Warning: Could not start change tracking, each webhook will rescan the root folder")
+
+        # Organize what is already in root; the change log only covers later uploads
+        organizer.organize_tracked(organizer.drive.list_files("root"))
+        flush_logs()
         
         # Start webhook subscription
         webhook_server = WebhookServer(organizer, webhook_url)